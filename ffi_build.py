@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# CFFI API-mode build script for pyescrypt._yescrypt.
+#
+# Referenced from setup.py via `cffi_modules`, and runnable directly for
+# development (`python ffi_build.py`). API mode generates compile-time C
+# wrappers, so each yescrypt call is a direct C call that releases the GIL,
+# instead of going through libffi's generic marshalling as in ABI mode. The
+# declarations below must stay in sync with the cdef block in
+# pyescrypt/pyescrypt.py, which remains as the ABI-mode fallback for
+# platforms where this module can't be compiled (see the comment at the top
+# of that file).
+import os
+import platform
+from pathlib import Path
+
+from cffi import FFI  # type: ignore
+
+SRC_DIR = Path(__file__).parent / "src" / "yescrypt"
+SOURCES = [
+    "yescrypt-opt.c",
+    "yescrypt-common.c",
+    "sha256.c",
+    "insecure_memzero.c",
+]
+
+# Mirror the makefile: AVX everywhere except macOS, where the oldest
+# supported toolchains only reliably take SSE2.
+SIMD = "-msse2" if platform.system() == "Darwin" else "-mavx"
+
+# Also mirroring the makefile: tune for the host CPU by default. setup.py
+# overrides this with a portable baseline (-march=x86-64-v2 on x86, nothing
+# elsewhere) for wheel builds, and an explicit MARCH in the environment wins
+# everywhere. An empty MARCH means no -march flag at all.
+MARCH = os.environ.get("MARCH", "-march=native")
+
+# SHA-NI opt-in for baseline builds (see the makefile for details);
+# -march=native already enables the extension on capable hosts.
+SHA_FLAGS = ["-msha", "-msse4.2"] if os.environ.get("SHA") else []
+
+ffi = FFI()
+
+ffi.cdef(
+    """
+    typedef uint32_t yescrypt_flags_t;
+
+    typedef struct {
+        void *base, *aligned;
+        size_t base_size, aligned_size;
+    } yescrypt_region_t;
+
+    typedef yescrypt_region_t yescrypt_shared_t;
+    typedef yescrypt_region_t yescrypt_local_t;
+
+    /**
+     * yescrypt parameters combined into one struct. N, r, p are the same as in
+     * classic scrypt, except that the meaning of p changes when YESCRYPT_RW is
+     * set. flags, t, g, NROM are special to yescrypt.
+     */
+    typedef struct {
+        yescrypt_flags_t flags;
+        uint64_t N;
+        uint32_t r, p, t, g;
+        uint64_t NROM;
+    } yescrypt_params_t;
+
+    typedef union {
+        unsigned char uc[32];
+        uint64_t u64[4];
+    } yescrypt_binary_t;
+
+    int yescrypt_init_local(yescrypt_local_t *local);
+    int yescrypt_free_local(yescrypt_local_t *local);
+    int yescrypt_init_shared(yescrypt_shared_t *shared,
+        const uint8_t *seed, size_t seedlen, const yescrypt_params_t *params);
+    int yescrypt_free_shared(yescrypt_shared_t *shared);
+
+    uint8_t *yescrypt_encode_params(const yescrypt_params_t *params,
+        const uint8_t *src, size_t srclen);
+
+    int yescrypt_kdf(const yescrypt_shared_t *shared,
+        yescrypt_local_t *local,
+        const uint8_t *passwd, size_t passwdlen,
+        const uint8_t *salt, size_t saltlen,
+        const yescrypt_params_t *params,
+        uint8_t *buf, size_t buflen);
+
+    uint8_t *yescrypt_r(const yescrypt_shared_t *shared, yescrypt_local_t *local,
+        const uint8_t *passwd, size_t passwdlen,
+        const uint8_t *setting,
+        const yescrypt_binary_t *key,
+        uint8_t *buf, size_t buflen);
+"""
+)
+
+ffi.set_source(
+    "pyescrypt._yescrypt",
+    '#include "yescrypt.h"',
+    sources=[str(SRC_DIR / source) for source in SOURCES],
+    include_dirs=[str(SRC_DIR)],
+    extra_compile_args=[
+        flag
+        for flag in (
+            "-O3",
+            "-funroll-loops",
+            "-fomit-frame-pointer",
+            "-flto",
+            "-fopenmp",
+            "-DSKIP_MEMZERO",
+            SIMD,
+            MARCH,
+            *SHA_FLAGS,
+        )
+        if flag
+    ],
+    extra_link_args=["-flto", "-fopenmp"],
+    # Tag the extension for the stable ABI so a single abi3 wheel covers
+    # 3.8+. CFFI takes care of defining Py_LIMITED_API on CPython.
+    py_limited_api=True,
+)
+
+if __name__ == "__main__":
+    ffi.compile(verbose=True)
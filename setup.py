@@ -1,10 +1,13 @@
 #!/usr/bin/env python
+import os
+import platform
+import shutil
 import subprocess
 import sys
 from distutils.command.build import build  # type: ignore
+from glob import glob
 
 from setuptools import find_packages, setup  # type: ignore
-from setuptools.command.install import install  # type: ignore
 from wheel.bdist_wheel import bdist_wheel as _bdist_wheel  # type: ignore
 
 _MAKE_TYPE = ""
@@ -19,40 +22,67 @@ class BdistWheel(_bdist_wheel):
     because it doesn't have a standard platform executable extension. But this
     at least gets it to name the wheels correctly, which is important since
     the names are stateful and will prevent pip installing when incorrect.
+
+    The API-mode module is compiled against the limited C API (CFFI defines
+    Py_LIMITED_API itself on CPython), so one cp38-abi3 wheel per platform
+    serves every interpreter from 3.8 up instead of one wheel per Python
+    version.
     """
 
     def finalize_options(self):
         _bdist_wheel.finalize_options(self)
         self.root_is_pure = False  # noqa
+        self.py_limited_api = "cp38"  # noqa
 
     def get_tag(self):
         python, abi, plat = _bdist_wheel.get_tag(self)
-        python, abi = "py3", "none"
+        python, abi = "cp38", "abi3"
         return python, abi, plat
 
 
+def _binary_is_fresh() -> bool:
+    """
+    Whether yescrypt.bin was built in the requested link mode and is newer
+    than all of the yescrypt sources.
+    """
+    target = os.path.join("src", "pyescrypt", "yescrypt.bin")
+    # The makefile stamps each build with its link mode; without the matching
+    # stamp the binary may be statically linked when dynamic was asked for
+    # (or vice versa), so it has to be rebuilt regardless of mtimes.
+    if not os.path.exists(target) or not os.path.exists(f"{target}.{_MAKE_TYPE}"):
+        return False
+    sources = glob("src/yescrypt/*.c") + glob("src/yescrypt/*.h") + ["makefile"]
+    target_mtime = os.stat(target).st_mtime
+    return all(os.stat(source).st_mtime < target_mtime for source in sources)
+
+
 def _build_source() -> None:
-    if subprocess.call(["make", "clean"]) != 0:
-        sys.exit(-1)
-    if subprocess.call(["make", _MAKE_TYPE]) != 0:
+    # The makefile makes the same freshness check, but pip can run the build
+    # command more than once per install (e.g. build then install for
+    # editable installs), and checking here skips even the make spawn on the
+    # repeat passes.
+    if _binary_is_fresh():
+        return
+    # No `make clean` here: the makefile tracks yescrypt.bin against its
+    # sources, so a fresh binary is simply left alone instead of being
+    # rebuilt on every wheel build.
+    env = os.environ.copy()
+    if "GCC" not in env and shutil.which("ccache"):
+        # When ccache is around, route the compiler through it so rebuilds
+        # with unchanged sources become cache hits.
+        env["GCC"] = "ccache gcc"
+    if subprocess.call(["make", _MAKE_TYPE], env=env) != 0:
         sys.exit(-1)
 
 
 class Build(build):
-    """Clear any built binaries and rebuild with make."""
+    """Build yescrypt with make when it's stale."""
 
     def run(self):
         _build_source()
         build.run(self)
 
 
-class BuildInstall(install):
-    """Build yescrypt when installing from source."""
-
-    def run(self):
-        super().run()
-
-
 if __name__ == "__main__":
     with open("REQUIREMENTS") as f:
         required = f.read().splitlines()
@@ -66,6 +96,31 @@ if __name__ == "__main__":
     else:
         _MAKE_TYPE = "static"
 
+    # Wheels travel, and the cp38-abi3 tag widens each one's audience, so
+    # default wheel builds to a portable baseline rather than silently baking
+    # the build host's instruction set into a generically tagged artifact.
+    # -march=native stays the default for local/source builds, and an
+    # explicit MARCH always wins (e.g. for arch-specific wheel batches).
+    # Non-x86 hosts get no -march flag at all rather than one GCC would
+    # reject. Both the makefile and ffi_build.py read MARCH from the
+    # environment.
+    if sys.argv[1] in ("bdist_wheel", "bdist_wheel_dynamic"):
+        if "MARCH" not in os.environ:
+            machine = platform.machine().lower()
+            os.environ["MARCH"] = (
+                "-march=x86-64-v2" if machine in ("x86_64", "amd64") else ""
+            )
+
+    # The API-mode module can only be built where distutils can drive GCC:
+    # not on Windows, where MSVC can't compile the yescrypt sources at all
+    # (see the comment at the top of pyescrypt.py). Skip the extension there
+    # and under PYESCRYPT_ABI_MODE=1, so those installs degrade to the
+    # makefile-built ABI binary instead of failing in build_ext.
+    if sys.platform == "win32" or os.environ.get("PYESCRYPT_ABI_MODE"):
+        cffi_modules = []
+    else:
+        cffi_modules = ["ffi_build.py:ffi"]
+
     setup(
         name="pyescrypt",
         version=version,
@@ -76,13 +131,15 @@ if __name__ == "__main__":
         author="Colt Blackmore",
         author_email="coltblackmore+pyescrypt@gmail.com",
         install_requires=required,
+        extras_require={"orjson": ["orjson"]},
+        setup_requires=["cffi>=1.0.0"],
+        cffi_modules=cffi_modules,
         license="BSD",
         url="https://https://github.com/0xcb/pyescrypt",
         packages=find_packages("src"),
         package_dir={"": "src"},
         package_data={"": ["yescrypt.bin"]},
         cmdclass={
-            "install": BuildInstall,
             "build": Build,
             "build_dynamic": Build,
             "bdist_wheel": BdistWheel,
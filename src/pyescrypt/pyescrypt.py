@@ -5,19 +5,37 @@
 # bad at using GCC on Windows, forces specific file prefixes and extensions on
 # compilation and linking, and just generally Does Not Work. This makes
 # supporting Yescrypt on multiple compilers and multiple platforms for CFFI's
-# API mode a non-starter. Instead we use a simple makefile and load the
-# generated binary in ABI mode.
+# API mode a non-starter there. Where GCC does work with distutils (Linux,
+# macOS), we build an API-mode module via ffi_build.py and prefer it at import
+# time: calls become direct C calls with compile-time-generated wrappers,
+# which is materially faster than ABI mode's libffi marshalling and releases
+# the GIL around the KDF. The makefile-built binary loaded in ABI mode remains
+# as the fallback, and can be forced with PYESCRYPT_ABI_MODE=1.
+import ctypes
 import json
+import os
 import secrets
-from base64 import b64decode, b64encode
+import sys
+import threading
+import weakref
+# The base64 module's b64encode/b64decode are Python-level wrappers around
+# these (b64encode also appends a newline it then slices back off); calling
+# binascii directly skips the extra dispatch on the hashing hot path.
+from binascii import a2b_base64, b2a_base64
 from enum import Enum
 from json import JSONDecodeError
-from pathlib import Path
 from typing import Any, cast, Optional
 
-from cffi import FFI  # type: ignore
-
-ffi = FFI()
+# orjson parses several times faster than the stdlib, which is noticeable in
+# compare() at low-N configurations where the KDF doesn't dominate. It's an
+# optional extra (`pip install pyescrypt[orjson]`); its JSONDecodeError
+# subclasses the stdlib's, so the handlers below work with either parser.
+# Encoding doesn't go through a parser anymore (digest() splices onto a
+# prefix rendered once in __init__), so only loads() is swapped.
+try:
+    from orjson import loads as _json_loads  # type: ignore
+except ImportError:
+    _json_loads = json.loads
 
 # Refer to yescrypt.h for details and private defines.
 # TODO: PARAMETERS are a compile-time decision. Using values other than those in
@@ -52,6 +70,9 @@ YESCRYPT_SBOX_768K = 0x380
 # Only valid for yescrypt_init_shared()
 YESCRYPT_SHARED_PREALLOCATED = 0x10000
 
+# From <asm-generic/mman-common.h>; stable across Linux architectures.
+_MADV_HUGEPAGE = 14
+
 YESCRYPT_RW_DEFAULTS = (
     YESCRYPT_RW
     | YESCRYPT_ROUNDS_6
@@ -62,8 +83,9 @@ YESCRYPT_RW_DEFAULTS = (
 
 YESCRYPT_DEFAULTS = YESCRYPT_RW_DEFAULTS
 
-ffi.cdef(
-    """
+# Kept in sync with ffi_build.py, which compiles the same declarations into
+# the API-mode module.
+_CDEF = """
     typedef uint32_t yescrypt_flags_t;
 
     typedef struct {
@@ -113,9 +135,26 @@ ffi.cdef(
         const yescrypt_binary_t *key,
         uint8_t *buf, size_t buflen);
 """
-)
 
-_LIB = ffi.dlopen(f"{Path(__file__).parent.resolve()}/yescrypt.bin")
+_LIB: Any = None
+if not os.environ.get("PYESCRYPT_ABI_MODE"):
+    try:
+        from pyescrypt._yescrypt import ffi, lib as _LIB  # type: ignore
+    except ImportError:
+        pass
+if _LIB is None:
+    from cffi import FFI  # type: ignore
+
+    ffi = FFI()
+    ffi.cdef(_CDEF)
+    # No Path.resolve() here -- dlopen doesn't need a canonical path and
+    # resolve() stats every component on import. RTLD_LAZY defers symbol
+    # resolution to first use, and RTLD_LOCAL keeps yescrypt's symbols
+    # (notably its SHA-256) out of the process-wide namespace.
+    _LIB = ffi.dlopen(
+        os.path.join(os.path.dirname(__file__), "yescrypt.bin"),
+        ffi.RTLD_LAZY | ffi.RTLD_LOCAL,
+    )
 
 
 class Mode(Enum):
@@ -140,6 +179,20 @@ class Yescrypt:
     _local_region: Any
     # Not implemented yet.
     _shared_region: Any
+    # Parameters are immutable per instance, so these are serialized once.
+    _cfg: dict
+    _json_prefix: str
+    # Scratch buffers reused across digest() calls; safe because instances
+    # aren't externally thread-safe to begin with.
+    _mcf_buffer: Any
+    _raw_buffer: Any
+    _raw_buffer_length: int
+    # Frees the local region when the instance is collected.
+    _finalizer: weakref.finalize
+    # MCF settings strings keyed by salt; see digest().
+    _settings_cache: dict
+    # Set once hashing memory is ready; digest() waits on it.
+    _warm_event: threading.Event
 
     def __init__(
         self,
@@ -148,6 +201,7 @@ class Yescrypt:
         t: int = 0,
         p: int = 1,
         mode: Mode = Mode.JSON,
+        warm_up: bool = False,
     ):
         """
         Creates a Yescrypt hasher with settings preconfigured and memory
@@ -167,12 +221,17 @@ class Yescrypt:
         :param t: An additional time factor. Useful for making hashing more
          expensive when more memory is not available.
         :param p: Parallelism. Unlike scrypt, threads in yescrypt don't increase
-         memory usage.
+         memory usage. Both builds compile yescrypt with OpenMP, so the p lanes
+         of the SMix phase run on separate cores, and CFFI releases the GIL for
+         the duration of the C call.
         :param mode: The encoding to expect for inputs and to generate for outputs.
          `Mode.JSON` encodes all relevant data and is the default. `Mode.MCF` is
          similar but uses the Modular Crypt Format, forces hashes to be 32 bytes
          (length is implicit, not encoded), and limits salts to 64 bytes. `Mode.RAW`
          applies no special encoding and leaves everything in the user's hands.
+        :param warm_up: Run `warm_up()` on a background thread so the hashing
+         memory is allocated and faulted in while the caller does other startup
+         work. The first `digest()` waits for it to finish.
         """
         self._mode = mode
 
@@ -182,19 +241,111 @@ class Yescrypt:
         self._params = ffi.new(
             "yescrypt_params_t*", (YESCRYPT_RW_DEFAULTS, n, r, p, t, g, nrom)
         )
+        # Serialize the parameters once rather than reflecting over the cdata
+        # with dir()/getattr on every digest(). The JSON header is also
+        # rendered here, leaving only key/salt to splice in per hash.
+        # NB: The keys must stay in sorted order: earlier releases collected
+        # them via dir(), which sorts, and compare() checks the full JSON
+        # bytes, so any other order would break every stored hash.
+        self._cfg = {
+            k: getattr(self._params, k)
+            for k in ("N", "NROM", "flags", "g", "p", "r", "t")
+        }
+        self._json_prefix = json.dumps(
+            {"alg": "yescrypt", "ver": "1.1", "cfg": self._cfg},
+            separators=(",", ":"),
+        )[:-1]
+        # Allocating per call would mean a malloc/free pair per hash, so the
+        # output buffers live with the instance instead. The MCF buffer holds
+        # an encoded 32-byte password and max 64-byte salt (128 bytes), with
+        # a 'y' for yescrypt, 4 $ delimeters, up to 8 6-byte parameters, and
+        # a null terminator. The raw buffer grows lazily if a digest() call
+        # asks for more than 64 bytes.
+        self._mcf_buffer = ffi.new("uint8_t[181]")
+        self._raw_buffer = ffi.new("uint8_t[64]")
+        self._raw_buffer_length = 64
+        self._settings_cache = {}
         self._local_region = ffi.new("yescrypt_local_t*")
         if _LIB.yescrypt_init_local(self._local_region):
             raise Exception("Initialization Error: yescrypt_init_local failed.")
-        # Force OS to allocate the memory for these parameters. New parameters
-        # should get a new Yescrypt instance.
+        # Registered only once init_local has succeeded, so there's nothing
+        # to guard against a partially constructed instance, and unlike
+        # __del__ it can't run after _LIB is torn down at interpreter
+        # shutdown (the finalizer holds its own reference to the function).
+        self._finalizer = weakref.finalize(
+            self, _LIB.yescrypt_free_local, self._local_region
+        )
         # NB: We use YESCRYPT_RW exclusively, so unlike in scrypt p doesn't
         # contribute to the size.
-        # TODO: The first execution of digest() isn't any faster when we pre-init
-        #  memory like this. Need to investigate. For now we'll simply call
-        #  digest() on load (cold start, not warm-up).
-        # from ctypes import memset
-        # ptr = int(ffi.cast('uint64_t', self._local_region.aligned))
-        # memset(ptr, 0, self._local_region.aligned_size)
+        # NB: The local region is allocated lazily inside the first KDF call,
+        # which is why the memset we used to attempt here never sped anything
+        # up -- at this point aligned_size is still 0 and there's nothing to
+        # touch. warm_up() runs a throwaway hash to take that first-call cost
+        # at a time of the caller's choosing.
+        self._warm_event = threading.Event()
+        if warm_up:
+            threading.Thread(target=self._warm_up_background, daemon=True).start()
+        else:
+            self._warm_event.set()
+
+    def _warm_up_background(self) -> None:
+        try:
+            self.warm_up()
+        finally:
+            # Unblock digest() even if warm-up failed; the real call will
+            # then surface its own error.
+            self._warm_event.set()
+
+    def warm_up(self) -> None:
+        """
+        Hashes a throwaway password to force allocation of this instance's
+        hashing memory.
+
+        yescrypt allocates the local working region lazily inside the first
+        KDF call, so for large parameters the first `digest()` pays for the
+        allocation and the page-fault storm of first touch on top of the hash
+        itself. Servers that verify many passwords with one instance can call
+        this once at startup, before traffic arrives, and every subsequent
+        `digest()` reuses the warm region. Constructing with `warm_up=True`
+        runs this on a background thread instead.
+        """
+        if _LIB.yescrypt_kdf(
+            ffi.NULL,
+            self._local_region,
+            b"",
+            0,
+            b"",
+            0,
+            self._params,
+            self._raw_buffer,
+            32,
+        ):
+            raise Exception("Hashing Error: yescrypt_kdf failed.")
+        self._advise_region()
+
+    def _advise_region(self) -> None:
+        """
+        Best-effort memory tuning for the local region on Linux. Transparent
+        huge pages cut DTLB misses for SMix's random 128-byte accesses (a
+        2 MiB page covers 512x the address space per TLB entry, and
+        khugepaged collapses the already-faulted region in the background),
+        and mlock keeps the region from being paged out between hashes. Both
+        are advisory; failures (non-Linux, RLIMIT_MEMLOCK, ...) are ignored.
+        """
+        if sys.platform != "linux":
+            return
+        size = self._local_region.aligned_size
+        if not size:
+            return
+        address = ctypes.c_void_p(
+            int(ffi.cast("uintptr_t", self._local_region.aligned))
+        )
+        try:
+            libc = ctypes.CDLL(None)
+            libc.madvise(address, ctypes.c_size_t(size), _MADV_HUGEPAGE)
+            libc.mlock(address, ctypes.c_size_t(size))
+        except OSError:
+            pass
 
     def digest(
         self,
@@ -217,6 +368,12 @@ class Yescrypt:
         :param hash_length: The desired hash length. Must be 32 when using `Mode.MCF`.
         :return: JSON-, MCF-, or raw-encoded hash bytes.
         """
+        # Returns immediately unless a warm_up=True background thread is
+        # still populating the local region.
+        self._warm_event.wait()
+        # Hoisted so the C call sites below build their argument tuples from
+        # plain locals.
+        password_length = len(password)
         if self._mode is Mode.MCF:
             if hash_length != 32:
                 raise ValueError(
@@ -230,52 +387,64 @@ class Yescrypt:
                         "Argument Error: A salt is required if not using MCF-encoded "
                         "settings."
                     )
-                settings = _LIB.yescrypt_encode_params(self._params, salt, len(salt))
-            if not settings:
-                raise Exception("Hashing Error: yescrypt_encode_params failed.")
-            # Buffer for encoded 32-byte password and max 64-byte salt (128 bytes),
-            # with a 'y' for yescrypt, 4 $ delimeters, up to 8 6-byte parameters,
-            # and a null terminator.
-            buf_length = 181
-            with ffi.new(f"uint8_t[{buf_length}]") as hash_buffer:
-                if not _LIB.yescrypt_r(
-                    ffi.NULL,
-                    self._local_region,
-                    password,
-                    len(password),
-                    settings,
-                    ffi.NULL,
-                    hash_buffer,
-                    buf_length,
-                ):
-                    raise Exception("Hashing Error: yescrypt_r failed.")
-                digest = ffi.string(hash_buffer, 10000)
+                # The settings string depends only on this instance's (fixed)
+                # parameters and the salt, so repeat hashes against the same
+                # salt skip re-encoding.
+                settings = self._settings_cache.get(salt)
+                if settings is None:
+                    encoded = _LIB.yescrypt_encode_params(
+                        self._params, salt, len(salt)
+                    )
+                    if not encoded:
+                        raise Exception(
+                            "Hashing Error: yescrypt_encode_params failed."
+                        )
+                    # yescrypt_encode_params returns a pointer into a static
+                    # buffer, so copy before caching.
+                    settings = ffi.string(encoded)
+                    # Crude bound so a caller cycling salts can't grow the
+                    # cache without limit.
+                    if len(self._settings_cache) >= 128:
+                        self._settings_cache.clear()
+                    self._settings_cache[salt] = settings
+            hash_buffer = self._mcf_buffer
+            if not _LIB.yescrypt_r(
+                ffi.NULL,
+                self._local_region,
+                password,
+                password_length,
+                settings,
+                ffi.NULL,
+                hash_buffer,
+                len(hash_buffer),
+            ):
+                raise Exception("Hashing Error: yescrypt_r failed.")
+            # Bounded by the real buffer size; yescrypt_r NUL-terminates the
+            # crypt string well inside it.
+            digest = ffi.string(hash_buffer, len(hash_buffer))
         else:
-            with ffi.new(f"uint8_t[{hash_length}]") as hash_buffer:
-                if _LIB.yescrypt_kdf(
-                    ffi.NULL,
-                    self._local_region,
-                    password,
-                    len(password),
-                    salt,
-                    len(cast(bytes, salt)),
-                    self._params,
-                    hash_buffer,
-                    hash_length,
-                ):
-                    raise Exception("Hashing Error: yescrypt_kdf failed.")
-                digest = bytes(hash_buffer)
+            if hash_length > self._raw_buffer_length:
+                self._raw_buffer = ffi.new(f"uint8_t[{hash_length}]")
+                self._raw_buffer_length = hash_length
+            hash_buffer = self._raw_buffer
+            salt_length = len(cast(bytes, salt))
+            if _LIB.yescrypt_kdf(
+                ffi.NULL,
+                self._local_region,
+                password,
+                password_length,
+                salt,
+                salt_length,
+                self._params,
+                hash_buffer,
+                hash_length,
+            ):
+                raise Exception("Hashing Error: yescrypt_kdf failed.")
+            digest = bytes(ffi.buffer(hash_buffer, hash_length))
             if self._mode is Mode.JSON:
-                digest = json.dumps(
-                    {
-                        "alg": "yescrypt",
-                        "ver": "1.1",
-                        "cfg": {k: getattr(self._params, k) for k in dir(self._params)},
-                        "key": b64encode(digest).decode(),
-                        "slt": b64encode(cast(bytes, salt)).decode(),
-                    },
-                    separators=(",", ":"),
-                ).encode()
+                key = b2a_base64(digest, newline=False).decode()
+                slt = b2a_base64(cast(bytes, salt), newline=False).decode()
+                digest = f'{self._json_prefix},"key":"{key}","slt":"{slt}"}}'.encode()
 
         return digest
 
@@ -308,9 +477,9 @@ class Yescrypt:
         :raises: WrongPassword, WrongPasswordConfiguration, ValueError
         """
         if self._mode == Mode.JSON:
-            try:
-                data = json.loads(hashed_password)
-            except JSONDecodeError:
+            # Sniff the first byte before paying for a JSON parse of data
+            # that can't possibly be ours.
+            if not hashed_password.startswith(b"{"):
                 if hashed_password.startswith(b"$y$"):
                     raise ValueError(
                         "Argument Error: MCF string passed to a JSON instance of "
@@ -321,33 +490,42 @@ class Yescrypt:
                         "Argument Error: Raw (probably) data passed to a JSON "
                         "instance of Yescrypt."
                     )
+            try:
+                data = _json_loads(hashed_password)
+            except JSONDecodeError:
+                raise ValueError(
+                    "Argument Error: Raw (probably) data passed to a JSON "
+                    "instance of Yescrypt."
+                )
             # Make sure the parameters of this instance of Yescrypt are compatible
-            # with those of the hashed password.
-            cfg = data["cfg"]
-            for k in cfg.keys():
-                if cfg[k] != getattr(self._params, k):
-                    raise WrongPasswordConfiguration(
-                        "Error: Password configurations are incompatible."
-                    )
-            salt = b64decode(data["slt"])
-            password_hash = self.digest(
-                password, salt=salt, hash_length=len(b64decode(data["key"]))
-            )
+            # with those of the hashed password. A single dict comparison against
+            # the cfg serialized in __init__ replaces per-key getattr reflection
+            # on the cdata.
+            if data["cfg"] != self._cfg:
+                raise WrongPasswordConfiguration(
+                    "Error: Password configurations are incompatible."
+                )
+            # Decode each field exactly once; this is the auth hot path.
+            key = a2b_base64(data["key"])
+            salt = a2b_base64(data["slt"])
+            password_hash = self.digest(password, salt=salt, hash_length=len(key))
         elif self._mode == Mode.MCF:
             if not hashed_password.startswith(b"$y$"):
-                try:
-                    _ = json.loads(hashed_password)
+                # Same cheap sniff as the JSON branch — no need to run the
+                # whole parser just to name the mismatch.
+                if hashed_password.startswith(b"{"):
                     raise ValueError(
                         "Argument Error: JSON passed to an MCF instance of Yescrypt."
                     )
-                except ValueError:
-                    raise
-                except Exception:
+                else:
                     raise ValueError(
                         "Argument Error: Raw (probably) data passed to an MCF "
                         "instance of Yescrypt."
                     )
-            settings = hashed_password[: hashed_password.rfind(b"$")]
+            # The last '$' sits just before the 43-byte base64 hash, so scan
+            # only the tail rather than the whole string.
+            tail_start = max(0, len(hashed_password) - 50)
+            settings = hashed_password[: hashed_password.rfind(b"$", tail_start)]
 
             # Length is always 32 in MCF mode.
             password_hash = self.digest(password, settings=settings, hash_length=32)
@@ -360,10 +538,6 @@ class Yescrypt:
         if not secrets.compare_digest(password_hash, hashed_password):
             raise WrongPassword("Error: Password does not match stored hash.")
 
-    def __del__(self) -> None:
-        if hasattr(self, "_local_region"):
-            _LIB.yescrypt_free_local(self._local_region)
-
 
 def main() -> None:
     # Example usage.